@@ -1,20 +1,33 @@
 # Routers/company.py
-from fastapi import APIRouter, HTTPException, Header, Depends, UploadFile, File, Request
+from fastapi import APIRouter, HTTPException, Header, Depends, UploadFile, File, Request, BackgroundTasks
 from fastapi import status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-import os, shutil, uuid
+from sqlalchemy import and_, or_, select, bindparam, update
+import os, uuid
+import asyncio
+import ctypes
+import logging
+from contextlib import suppress
+from functools import lru_cache
+import aiofiles
 import warnings
 warnings.filterwarnings("ignore")
 
 import models, schemas
 from database import engine, Base, SessionLocal
-from Services.chat_services import extract_name_from_pdf, conversational_chain
-from Services.vectorstore import add_documents_to_collection, get_retriever_for_company
+from Services.chat_services import extract_name_from_pdf, conversational_chain, get_session_memory, clear_session_memory, start_answer_stream
+from Services.vectorstore import add_documents_to_collection, get_retriever_for_company, run_in_cpu_pool
 from Services.pdf_validator import document_validator
+from Services.security import hash_password, verify_password, password_needs_rehash
 
-# Create tables if they don't exist
+# Create tables if they don't exist, move any pre-existing JSON file lists into
+# them, and bring old team/project tables up to the per-company name constraints
 Base.metadata.create_all(bind=engine)
+models.migrate_json_file_lists(engine)
+models.migrate_name_constraints(engine)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/company",
@@ -31,16 +44,141 @@ def get_db():
         db.close()
 
 
+# Upload folders only need creating once per process
+@lru_cache(maxsize=4096)
+def _ensure_dir(path: str):
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# Linux fallocate(2), not posix_fallocate(): where the filesystem can't
+# preallocate, glibc's posix_fallocate falls back to writing the whole size in
+# zeros, doubling the I/O; fallocate just fails and the upload is written as is
+_fallocate = getattr(ctypes.CDLL(None, use_errno=True), "fallocate", None)
+if _fallocate is not None:
+    _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+
+
+def _open_preallocated(path: str, size):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    if size and _fallocate is not None:
+        _fallocate(fd, 0, 0, size)  # best effort; the return code is ignored
+    return fd
+
+
+def _discard(path: str):
+    with suppress(FileNotFoundError):
+        os.remove(path)
+
+
+# Stream an upload to `folder` in 1 MiB chunks. When the size is known up front
+# the file is preallocated, so large PDFs don't grow extent by extent. The
+# open/preallocate syscalls run in a thread; a failed or cancelled upload
+# closes the file and removes the partial copy.
+async def save_upload(file: UploadFile, folder: str):
+    unique_filename = f"{uuid.uuid4().hex}_{file.filename}"
+    saved_path = os.path.join(_ensure_dir(folder), unique_filename)
+
+    fd = await asyncio.to_thread(_open_preallocated, saved_path, file.size)
+    buffer = None
+    try:
+        buffer = await aiofiles.open(fd, "wb", buffering=1 << 20)
+        while chunk := await file.read(1 << 20):
+            await buffer.write(chunk)
+        await buffer.close()
+    except BaseException:
+        # until aiofiles has wrapped fd, closing it is still up to us
+        if buffer is None:
+            os.close(fd)
+        else:
+            with suppress(OSError):
+                await buffer.close()
+        await asyncio.to_thread(_discard, saved_path)
+        raise
+
+    return unique_filename, saved_path
+
+
+# Document name from the LLM; best effort, since by the time it fails the
+# chunks may already be indexed and searchable, so the upload keeps its
+# original filename instead of being marked failed
+async def _extract_name(documents, fallback: str):
+    try:
+        return await asyncio.to_thread(extract_name_from_pdf, documents)
+    except Exception:
+        logger.warning("Name extraction for %s failed; keeping the uploaded name", fallback, exc_info=True)
+        return fallback
+
+
+def _set_file_status(file_model, file_info: dict):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(file_model)
+            .where(file_model.parent_id == file_info["parent_id"])
+            .values(pdf_name=file_info["pdf_name"], status=file_info["status"], error=file_info["error"])
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+# Background task behind every upload endpoint: parse the saved PDF, extract its
+# name and embed it, then flip the file's `file_model` row (CompanyFile /
+# TeamFile / ProjectFile) from "processing" to "ready" (or "failed"). Runs after
+# the 202 response is sent, with its own DB session; the blocking steps run in
+# worker threads, and `add_documents` (an async add_documents_to_*) embeds
+# through the shared batcher. Only parsing or indexing failures mark the file
+# "failed".
+async def ingest_upload(file_model, file_info: dict, add_documents, *scope_ids):
+    file_info = dict(file_info)
+    try:
+        documents = await run_in_cpu_pool(document_validator, file_info["source"])
+
+        # Name extraction (LLM call) and embedding are independent; run them concurrently
+        extracted_name, _ = await asyncio.gather(
+            _extract_name(documents, file_info["pdf_name"]),
+            add_documents(
+                *scope_ids,
+                documents,
+                file_name=file_info["filename"],
+                parent_id=file_info["parent_id"]
+            )
+        )
+        file_info.update(pdf_name=extracted_name, status="ready", error=None)
+    except Exception as e:
+        # the client already has its 202; keep the traceback in the log and a
+        # short reason on the file row, where the dashboards can show it
+        logger.exception("Ingesting %s failed", file_info["filename"])
+        file_info.update(status="failed", error=(str(e) or type(e).__name__)[:200])
+
+    await asyncio.to_thread(_set_file_status, file_model, file_info)
+
+
 @router.get("/")
 async def home():
     return {"message": "Document Intelligent System for Companies"}
 
 
+# -------------------- Hot lookups --------------------
+# Built once so SQLAlchemy's compiled-statement cache always hits
+_SEL_USER_BY_TOKEN = select(models.Company).where(
+    models.Company.session_token == bindparam("token")
+)
+
+_SEL_COMPANY_LOGIN = select(models.Company).where(
+    and_(
+        models.Company.username == bindparam("username"),
+        models.Company.company_name == bindparam("company_name")
+    )
+)
+
+
 # -------------------- Authentication Dependency --------------------
 def get_current_user(x_token: str = Header(None), db: Session = Depends(get_db)):
     if not x_token:
         raise HTTPException(status_code=401, detail="X-Token header missing")
-    user = db.query(models.Company).filter(models.Company.session_token == x_token).first()
+    user = db.execute(_SEL_USER_BY_TOKEN, {"token": x_token}).scalars().first()
     if not user:
         raise HTTPException(status_code=401, detail="Invalid Token")
     return user
@@ -68,18 +206,32 @@ async def register_company(request: Request, db: Session = Depends(get_db)):
         # return readable error for invalid payload
         raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
 
-    # Check duplicates
-    existing_username = db.query(models.Company).filter(models.Company.username == user.username).first()
-    existing_company = db.query(models.Company).filter(models.Company.company_name == user.company_name).first()
-    existing_email = db.query(models.Company).filter(models.Company.company_email == user.company_email).first()
+    # Check duplicates in a single roundtrip (all three columns are unique-indexed)
+    existing = db.query(
+        models.Company.username,
+        models.Company.company_name,
+        models.Company.company_email
+    ).filter(
+        or_(
+            models.Company.username == user.username,
+            models.Company.company_name == user.company_name,
+            models.Company.company_email == user.company_email
+        )
+    ).first()
 
-    if existing_username or existing_company or existing_email:
-        raise HTTPException(status_code=400, detail="User with given username, company name, or email already exists")
+    if existing:
+        if existing.username == user.username:
+            detail = "User with given username already exists"
+        elif existing.company_name == user.company_name:
+            detail = "User with given company name already exists"
+        else:
+            detail = "User with given email already exists"
+        raise HTTPException(status_code=400, detail=detail)
 
     company_user = models.Company(
         username=user.username,
         company_name=user.company_name,
-        password=user.password,
+        password=await asyncio.to_thread(hash_password, user.password),
         company_email=user.company_email
     )
 
@@ -108,16 +260,22 @@ async def company_login(request: Request, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
 
-    user = db.query(models.Company).filter(
-        and_(
-            models.Company.username == form_obj.username,
-            models.Company.company_name == form_obj.company_name
-        )
-    ).first()
+    user = db.execute(
+        _SEL_COMPANY_LOGIN,
+        {"username": form_obj.username, "company_name": form_obj.company_name}
+    ).scalars().first()
 
-    if not user or user.password != form_obj.password:
+    # argon2 is deliberately slow; keep it off the event loop
+    if not user or not await asyncio.to_thread(verify_password, user.password, form_obj.password):
         raise HTTPException(status_code=401, detail="Incorrect username, company name, or password")
 
+    if password_needs_rehash(user.password):
+        user.password = await asyncio.to_thread(hash_password, form_obj.password)
+
+    # the previous token stops working, so drop the chat history tied to it
+    if user.session_token:
+        clear_session_memory(user.session_token)
+
     token = uuid.uuid4().hex
     user.session_token = token
     db.commit()
@@ -132,57 +290,62 @@ def read_me(current_user: models.Company = Depends(get_current_user)):
 
 
 # -------------------- Logout --------------------
+# async so clear_session_memory runs on the event loop, like every other
+# access to the (not thread-safe) session-memory cache
 @router.post("/logout")
-def logout(current_user: models.Company = Depends(get_current_user), db: Session = Depends(get_db)):
+async def logout(current_user: models.Company = Depends(get_current_user), db: Session = Depends(get_db)):
+    clear_session_memory(current_user.session_token)
     current_user.session_token = None
     db.commit()
     return {"message": "Logged out"}
 
 
 # -------------------- Upload PDF + create embeddings --------------------
-@router.post("/upload_pdf", response_model=schemas.CompanyOut)
+# The file is saved and recorded as "processing"; parsing and embedding happen
+# in a background task, so the client gets 202 right away.
+@router.post("/upload_pdf", response_model=schemas.FileInfo, status_code=status.HTTP_202_ACCEPTED)
 async def upload_pdf(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: models.Company = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     try:
         company_folder = os.path.join("uploads", f"company_{current_user.id}")
-        os.makedirs(company_folder, exist_ok=True)
-
-        unique_filename = f"{uuid.uuid4().hex}_{file.filename}"
-        saved_path = os.path.join(company_folder, unique_filename)
-
-        with open(saved_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        documents = document_validator(saved_path)
-        sources = list({doc.metadata.get("source", "unknown") for doc in documents})
-        source = sources[0] if sources else "unknown"
-
-        extracted_name = extract_name_from_pdf(documents)
-
-        parent_id = add_documents_to_collection(str(current_user.id), documents, file_name=unique_filename)
+        unique_filename, saved_path = await save_upload(file, company_folder)
 
+        # pdf_name is the uploaded name until the background task extracts the real one
         extracted_info = {
-            "pdf_name": extracted_name,
-            "source": source,
+            "pdf_name": file.filename,
+            "source": saved_path,
             "filename": unique_filename,
-            "parent_id": parent_id
+            "parent_id": str(uuid.uuid4()),
+            "status": "processing"
         }
-        existing_files = current_user.company_files_name or []
-        current_user.company_files_name = existing_files + [extracted_info]
-
+        db.add(models.CompanyFile(company_id=current_user.id, **extracted_info))
         db.commit()
-        db.refresh(current_user)
 
-        return current_user
+        background_tasks.add_task(
+            ingest_upload,
+            models.CompanyFile, extracted_info,
+            add_documents_to_collection, str(current_user.id)
+        )
+
+        # only the new entry; the client already has (or can re-fetch) the rest
+        return extracted_info
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # -------------------- Chat endpoint (per-company retrieval) --------------------
+# Retriever + chain are built once per company and reused across messages
+@lru_cache(maxsize=512)
+def _company_chain(company_id: str):
+    retriever = get_retriever_for_company(company_id, k=5, fetch_k=20)
+    return conversational_chain(retriever)
+
+
 @router.post("/chat")
 async def chat_endpoint(
     chat: schemas.ChatRequest,
@@ -191,14 +354,13 @@ async def chat_endpoint(
 ):
     try:
         company_id = str(current_user.id)
-        retriever = get_retriever_for_company(company_id, k=5, fetch_k=20)
-        chain = conversational_chain(retriever)
-
-        result = chain.invoke({"question": chat.message})
-        answer = result["answer"]
-
-        # optionally include sources if you want; keeping minimal to match prior behavior
-        return {"answer": answer}
+        chain = _company_chain(company_id)
+        memory = get_session_memory(current_user.session_token, f"co:{company_id}")
+        # fails here (-> 500) if retrieval or the LLM errors before the first token
+        stream = await start_answer_stream(chain, chat.message, memory)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+    # stream the answer as plain text tokens as they are generated
+    return StreamingResponse(stream, media_type="text/plain")
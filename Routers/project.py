@@ -1,14 +1,21 @@
 # project_router.py
-import uuid
 import os
-import shutil
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+import uuid
+import asyncio
+from functools import lru_cache
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, status, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy import select, bindparam, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from typing import List
 
 import models, schemas
-from Services.chat_services import extract_name_from_pdf, conversational_chain, build_project_plan
-from Routers.company import get_current_user, get_db
-from Services.pdf_validator import document_validator
+from Services.chat_services import conversational_chain, build_project_plan, get_session_memory, start_answer_stream
+from Routers.company import get_current_user, get_db, save_upload, ingest_upload
+from Services.security import hash_password, verify_password, password_needs_rehash
 from Services.vectorstore import add_documents_to_project, get_project_retriever
 
 router = APIRouter(
@@ -16,6 +23,17 @@ router = APIRouter(
     tags=["Project Management"]
 )
 
+# Project lookups are always scoped to the logged-in company
+_SEL_PROJECT_BY_ID = select(models.Project).where(
+    models.Project.id == bindparam("project_id"),
+    models.Project.company_id == bindparam("company_id")
+)
+
+_SEL_PROJECT_BY_NAME = select(models.Project).where(
+    models.Project.project_name == bindparam("project_name"),
+    models.Project.company_id == bindparam("company_id")
+)
+
 # --------------------- REGISTER PROJECT ---------------------
 @router.post("/project_register", response_model=schemas.ProjectOut)
 async def register_project(
@@ -23,26 +41,42 @@ async def register_project(
     current_user: models.Company = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Ensure project name is unique within the company
-    existing_project = db.query(models.Project).filter(
-        models.Project.project_name == project.project_name,
-        models.Project.company_id == current_user.id
-    ).first()
+    # Project name is unique within the company (composite unique constraint);
+    # a single INSERT .. ON CONFLICT DO NOTHING is race-free and needs no pre-check
+    stmt = (
+        insert(models.Project)
+        .values(
+            project_name=project.project_name,
+            project_password=await asyncio.to_thread(hash_password, project.project_password),
+            company_id=current_user.id
+        )
+        .on_conflict_do_nothing(index_elements=["company_id", "project_name"])
+        .returning(models.Project)
+    )
+    try:
+        project_obj = db.execute(stmt).scalar()
+    except IntegrityError:
+        # a constraint ON CONFLICT doesn't target (e.g. a leftover global unique)
+        db.rollback()
+        project_obj = None
+    except OperationalError:
+        # no (company_id, project_name) unique index: the startup migration
+        # couldn't add it because of existing duplicate names
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="Project names are not unique within this company yet; rename the duplicates first"
+        )
 
-    if existing_project:
+    if project_obj is None:
         raise HTTPException(status_code=400, detail="Project name already exists for this company")
 
-    project_obj = models.Project(
-        project_name=project.project_name,
-        project_password=project.project_password,
-        company_id=current_user.id
+    db.execute(
+        update(models.Company)
+        .where(models.Company.id == current_user.id)
+        .values(no_of_projects=models.Company.no_of_projects + 1)
     )
-
-    db.add(project_obj)
-    current_user.no_of_projects +=1
     db.commit()
-    db.refresh(project_obj)
-    db.refresh(current_user) 
 
     return project_obj
 
@@ -58,82 +92,97 @@ async def project_login(
     Handles the login request for a specific project under a logged-in company.
     """
     # Find the project under the current logged-in company
-    project = db.query(models.Project).filter(
-        models.Project.project_name == project_name,
-        models.Project.company_id == current_user.id
-    ).first()
+    project = db.execute(
+        _SEL_PROJECT_BY_NAME,
+        {"project_name": project_name, "company_id": current_user.id}
+    ).scalars().first()
 
     if not project:
         raise HTTPException(status_code=404, detail="Project not found under this company")
 
-    # Verify the password (ensure this matches your registration method, e.g., hashing in production)
-    if project.project_password != project_password:
+    # Verify the argon2 password hash (off the event loop)
+    if not await asyncio.to_thread(verify_password, project.project_password, project_password):
         raise HTTPException(status_code=401, detail="Invalid project password")
 
+    if password_needs_rehash(project.project_password):
+        project.project_password = await asyncio.to_thread(hash_password, project_password)
+        db.commit()
+
     return project
 
 
 # --------------------- UPLOAD DOCS TO PROJECT ---------------------
-@router.post("/upload_project_pdf", response_model=schemas.ProjectOut)
+@router.post("/upload_project_pdf", response_model=schemas.FileInfo, status_code=status.HTTP_202_ACCEPTED)
 async def upload_project_docs(
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.Company = Depends(get_current_user),
     file: UploadFile = File(...),
     project_id: int = Form(...)
 ):
     # Validate project exists under current company
-    project = db.query(models.Project).filter(
-        models.Project.id == project_id,
-        models.Project.company_id == current_user.id
-    ).first()
+    project = db.execute(
+        _SEL_PROJECT_BY_ID,
+        {"project_id": project_id, "company_id": current_user.id}
+    ).scalar_one_or_none()
 
     if not project:
         raise HTTPException(status_code=404, detail="Project not found under this company")
 
     # Save file under company/project folder
     project_folder = os.path.join("uploads", f"company_{current_user.id}", f"project_{project_id}")
-    os.makedirs(project_folder, exist_ok=True)
-
-    unique_filename = f"{uuid.uuid4().hex}_{file.filename}"
-    saved_path = os.path.join(project_folder, unique_filename)
+    unique_filename, saved_path = await save_upload(file, project_folder)
 
-    with open(saved_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Load docs from file
-    documents = document_validator(saved_path)
-    sources = list({doc.metadata.get("source", "unknown") for doc in documents})
-    source = sources[0] if sources else "unknown"
+    # Save metadata in DB as "processing"; name extraction and embedding
+    # run in the background and mark it "ready"
+    new_file_info = {
+        "pdf_name": file.filename,
+        "source": saved_path,
+        "filename": unique_filename,
+        "parent_id": str(uuid.uuid4()),
+        "status": "processing"
+    }
 
-    # Extract readable name
-    extracted_name = extract_name_from_pdf(documents)
+    db.add(models.ProjectFile(project_id=project.id, **new_file_info))
+    db.commit()
 
-    # Add to vectorstore
-    parent_id = add_documents_to_project(
-        str(current_user.id),
-        str(project.id),
-        documents,
-        file_name=unique_filename
+    background_tasks.add_task(
+        ingest_upload,
+        models.ProjectFile, new_file_info,
+        add_documents_to_project, str(current_user.id), str(project.id)
     )
 
-    # Save metadata in DB
-    new_file_info = {
-        "pdf_name": extracted_name,
-        "source": source,
-        "filename": unique_filename,
-        "parent_id": parent_id
-    }
+    return new_file_info
 
-    existing_files = project.project_files_name or []
-    project.project_files_name = existing_files + [new_file_info]
 
-    db.commit()
-    db.refresh(project)
+# --------------------- PROJECT FILES ---------------------
+# Current file list with each upload's status, so the dashboard can follow
+# background ingestion from "processing" to "ready" / "failed"
+@router.get("/project_files", response_model=List[schemas.FileInfo])
+async def project_files(
+    project_id: int,
+    current_user: models.Company = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    project = db.execute(
+        _SEL_PROJECT_BY_ID,
+        {"project_id": project_id, "company_id": current_user.id}
+    ).scalar_one_or_none()
 
-    return project
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found under this company")
+
+    return project.project_files_name
 
 
 # --------------------- PROJECT CHAT ---------------------
+# Retriever + chain are built once per project and reused across messages
+@lru_cache(maxsize=512)
+def _project_chain(company_id: str, project_id: str):
+    retriever = get_project_retriever(company_id, project_id, k=5, fetch_k=20)
+    return conversational_chain(retriever)
+
+
 @router.post("/project_chat")
 async def project_chat(
     chat: schemas.ChatRequest,
@@ -142,10 +191,10 @@ async def project_chat(
     db: Session = Depends(get_db),
 ):
     # Validate project exists under current company
-    project = db.query(models.Project).filter(
-        models.Project.id == project_id,
-        models.Project.company_id == current_user.id
-    ).first()
+    project = db.execute(
+        _SEL_PROJECT_BY_ID,
+        {"project_id": project_id, "company_id": current_user.id}
+    ).scalar_one_or_none()
 
     if not project:
         raise HTTPException(status_code=404, detail="Project not found under this company")
@@ -154,17 +203,17 @@ async def project_chat(
         company_id = str(current_user.id)
         project_id_str = str(project.id)
 
-        retriever = get_project_retriever(company_id, project_id_str, k=5, fetch_k=20)
-        chain = conversational_chain(retriever)
-
-        result = chain.invoke({"question": chat.message})
-        answer = result["answer"]
-
-        return {"answer": answer}
+        chain = _project_chain(company_id, project_id_str)
+        memory = get_session_memory(current_user.session_token, f"pj:{company_id}:{project_id_str}")
+        # fails here (-> 500) if retrieval or the LLM errors before the first token
+        stream = await start_answer_stream(chain, chat.message, memory)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    # stream the answer as plain text tokens as they are generated
+    return StreamingResponse(stream, media_type="text/plain")
+
     
 
 @router.post("/project_information")
@@ -175,10 +224,10 @@ async def project_information(
     db: Session = Depends(get_db),
 ):
     # validate project
-    project = db.query(models.Project).filter(
-        models.Project.id == project_id,
-        models.Project.company_id == current_user.id
-    ).first()
+    project = db.execute(
+        _SEL_PROJECT_BY_ID,
+        {"project_id": project_id, "company_id": current_user.id}
+    ).scalar_one_or_none()
 
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -204,16 +253,16 @@ async def generate_project_plan(
     db: Session = Depends(get_db),
 ):
     # Ensure the project exists under this company
-    project = db.query(models.Project).filter(
-        models.Project.id == project_id,
-        models.Project.company_id == current_user.id
-    ).first()
+    project = db.execute(
+        _SEL_PROJECT_BY_ID,
+        {"project_id": project_id, "company_id": current_user.id}
+    ).scalar_one_or_none()
 
     if not project:
         raise HTTPException(status_code=404, detail="Project not found under this company")
 
     try:
-        result = build_project_plan(
+        result = await build_project_plan(
             domain=project.domain or "",
             project_name=project.project_name,
             no_project_members=project.no_project_members or 0,
@@ -1,14 +1,21 @@
-import uuid
 import os
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+import uuid
+import asyncio
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, status, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-import shutil
+from sqlalchemy import select, bindparam, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from functools import lru_cache
+
+from typing import List
 
 import models, schemas
 
-from Services.chat_services import extract_name_from_pdf, conversational_chain
-from Routers.company import get_current_user, get_db
-from Services.pdf_validator import document_validator
+from Services.chat_services import conversational_chain, get_session_memory, start_answer_stream
+from Routers.company import get_current_user, get_db, save_upload, ingest_upload
+from Services.security import hash_password, verify_password, password_needs_rehash
 from Services.vectorstore import get_team_retriever , add_documents_to_team
 
 
@@ -17,32 +24,59 @@ router = APIRouter(
     tags=["Team Management"]
 )
 
+# Team lookups are always scoped to the logged-in company
+_SEL_TEAM_BY_ID = select(models.Team).where(
+    models.Team.id == bindparam("team_id"),
+    models.Team.company_id == bindparam("company_id")
+)
+
+_SEL_TEAM_BY_NAME = select(models.Team).where(
+    models.Team.team_name == bindparam("team_name"),
+    models.Team.company_id == bindparam("company_id")
+)
+
 @router.post('/team_register', response_model=schemas.TeamOut)
 async def team_register(
     team_user: schemas.TeamCreate,
     current_user: models.Company = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Ensure team name is unique within the company
-    team_existing = db.query(models.Team).filter(
-        models.Team.team_name == team_user.team_name,
-        models.Team.company_id == current_user.id
-    ).first()
-
-    if team_existing:
-        raise HTTPException(status_code=400, detail="Team name already exists for this company")
-    
-    team_obj = models.Team(
-        team_name=team_user.team_name,
-        team_password=team_user.team_password,
-        company_id=current_user.id
+    # Team name is unique within the company (composite unique constraint);
+    # a single INSERT .. ON CONFLICT DO NOTHING is race-free and needs no pre-check
+    stmt = (
+        insert(models.Team)
+        .values(
+            team_name=team_user.team_name,
+            team_password=await asyncio.to_thread(hash_password, team_user.team_password),
+            company_id=current_user.id
+        )
+        .on_conflict_do_nothing(index_elements=["company_id", "team_name"])
+        .returning(models.Team)
     )
+    try:
+        team_obj = db.execute(stmt).scalar()
+    except IntegrityError:
+        # a constraint ON CONFLICT doesn't target (e.g. a leftover global unique)
+        db.rollback()
+        team_obj = None
+    except OperationalError:
+        # no (company_id, team_name) unique index: the startup migration
+        # couldn't add it because of existing duplicate names
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="Team names are not unique within this company yet; rename the duplicates first"
+        )
+
+    if team_obj is None:
+        raise HTTPException(status_code=400, detail="Team name already exists for this company")
 
-    db.add(team_obj)
-    current_user.no_of_teams += 1
+    db.execute(
+        update(models.Company)
+        .where(models.Company.id == current_user.id)
+        .values(no_of_teams=models.Company.no_of_teams + 1)
+    )
     db.commit()
-    db.refresh(team_obj)
-    db.refresh(current_user) 
 
     return team_obj
 
@@ -54,81 +88,96 @@ async def team_login(
     db: Session = Depends(get_db)
 ):
     # Find team under current company
-    team = db.query(models.Team).filter(
-        models.Team.team_name == team_name,
-        models.Team.company_id == current_user.id
-    ).first()
+    team = db.execute(
+        _SEL_TEAM_BY_NAME,
+        {"team_name": team_name, "company_id": current_user.id}
+    ).scalars().first()
 
     if not team:
         raise HTTPException(status_code=404, detail="Team not found under this company")
 
-    # Verify password (plain text for now, hash later)
-    if team.team_password != team_password:
+    # Verify the argon2 password hash (off the event loop)
+    if not await asyncio.to_thread(verify_password, team.team_password, team_password):
         raise HTTPException(status_code=401, detail="Invalid team password")
 
+    if password_needs_rehash(team.team_password):
+        team.team_password = await asyncio.to_thread(hash_password, team_password)
+        db.commit()
+
     return team
 
 
-@router.post("/team_upload", response_model=schemas.TeamOut)
+@router.post("/team_upload", response_model=schemas.FileInfo, status_code=status.HTTP_202_ACCEPTED)
 async def team_upload(
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.Company = Depends(get_current_user),
     file: UploadFile = File(...),
     team_id: int = Form(...)
 ):
     # Validate team exists under current company
-    team = db.query(models.Team).filter(
-        models.Team.id == team_id,
-        models.Team.company_id == current_user.id
-    ).first()
+    team = db.execute(
+        _SEL_TEAM_BY_ID,
+        {"team_id": team_id, "company_id": current_user.id}
+    ).scalar_one_or_none()
 
     if not team:
         raise HTTPException(status_code=404, detail="Team not found under this company")
 
     # Save PDF under company/team folder
     company_folder = os.path.join("uploads", f"company_{current_user.id}", f"team_{team_id}")
-    os.makedirs(company_folder, exist_ok=True)
-
-    unique_filename = f"{uuid.uuid4().hex}_{file.filename}"
-    saved_path = os.path.join(company_folder, unique_filename)
+    unique_filename, saved_path = await save_upload(file, company_folder)
 
-    with open(saved_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Load docs from PDF
-    documents = document_validator(saved_path)
-    sources = list({doc.metadata.get("source", "unknown") for doc in documents})
-    source = sources[0] if sources else "unknown"
+    # Store file metadata in team record (JSON-friendly dicts instead of strings);
+    # name extraction and embedding run in the background and mark it "ready"
+    new_file_info = {
+        "pdf_name": file.filename,
+        "source": saved_path,
+        "filename": unique_filename,
+        "parent_id": str(uuid.uuid4()),
+        "status": "processing"
+    }
 
-    # Extract PDF readable name
-    extracted_name = extract_name_from_pdf(documents)
+    db.add(models.TeamFile(team_id=team.id, **new_file_info))
+    db.commit()
 
-    # Add to team collection
-    parent_id = add_documents_to_team(
-        str(current_user.id),
-        str(team.id),
-        documents,
-        file_name=unique_filename
+    background_tasks.add_task(
+        ingest_upload,
+        models.TeamFile, new_file_info,
+        add_documents_to_team, str(current_user.id), str(team.id)
     )
 
-    # Store file metadata in team record (JSON-friendly dicts instead of strings)
-    new_file_info = {
-        "pdf_name": extracted_name,
-        "source": source,
-        "filename": unique_filename,
-        "parent_id": parent_id
-    }
+    return new_file_info
 
-    existing_files = team.team_files_name or []
-    team.team_files_name = existing_files + [new_file_info]
 
-    db.commit()
-    db.refresh(team)
+# --------------------- TEAM FILES ---------------------
+# Current file list with each upload's status, so the dashboard can follow
+# background ingestion from "processing" to "ready" / "failed"
+@router.get("/team_files", response_model=List[schemas.FileInfo])
+async def team_files(
+    team_id: int,
+    current_user: models.Company = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    team = db.execute(
+        _SEL_TEAM_BY_ID,
+        {"team_id": team_id, "company_id": current_user.id}
+    ).scalar_one_or_none()
 
-    return team
+    if not team:
+        raise HTTPException(status_code=404, detail="Team not found under this company")
+
+    return team.team_files_name
 
 
 # --------------------- TEAM CHAT ---------------------
+# Retriever + chain are built once per team and reused across messages
+@lru_cache(maxsize=512)
+def _team_chain(company_id: str, team_id: str):
+    retriever = get_team_retriever(company_id, team_id, k=5, fetch_k=20)
+    return conversational_chain(retriever)
+
+
 @router.post("/team_chat")
 async def team_chat(
     message: str = Form(...),
@@ -137,10 +186,10 @@ async def team_chat(
     db: Session = Depends(get_db),
 ):
     # Validate team exists under current company
-    team = db.query(models.Team).filter(
-        models.Team.id == team_id,
-        models.Team.company_id == current_user.id
-    ).first()
+    team = db.execute(
+        _SEL_TEAM_BY_ID,
+        {"team_id": team_id, "company_id": current_user.id}
+    ).scalar_one_or_none()
 
     if not team:
         raise HTTPException(status_code=404, detail="Team not found under this company")
@@ -149,14 +198,12 @@ async def team_chat(
         company_id = str(current_user.id)
         team_id = str(team.id)
 
-        # Build retriever
-        retriever = get_team_retriever(company_id, team_id, k=5, fetch_k=20)
-        chain = conversational_chain(retriever)
-
-        result = chain.invoke({"question": message})
-        answer = result["answer"]
-
-        return {"answer": answer}
+        chain = _team_chain(company_id, team_id)
+        memory = get_session_memory(current_user.session_token, f"tm:{company_id}:{team_id}")
+        # fails here (-> 500) if retrieval or the LLM errors before the first token
+        stream = await start_answer_stream(chain, message, memory)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+    return StreamingResponse(stream, media_type="text/plain")
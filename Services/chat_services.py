@@ -1,4 +1,5 @@
 import os
+import logging
 import warnings
 from dotenv import load_dotenv
 
@@ -8,19 +9,21 @@ warnings.filterwarnings('ignore')
 from langchain_groq.chat_models import ChatGroq
 from langchain.chains import ConversationalRetrievalChain
 from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationSummaryBufferMemory
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 
 import os
-from langchain.chat_models import init_chat_model
+import httpx
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from typing import List, Dict
-from langchain_core.runnables import RunnablePassthrough
+from cachetools import TTLCache
 
 
 
+logger = logging.getLogger(__name__)
+
 # Load API Keys from .env file
 load_dotenv()
 key = os.getenv("GROQ_API_KEY")
@@ -29,17 +32,93 @@ if not key:
 
 os.environ["GROQ_API_KEY"] = key
 
+# Shared connection pools for every Groq call (sync and async), so requests
+# reuse keep-alive connections instead of opening a new TLS session each time
+_http_limits = httpx.Limits(max_connections=200, max_keepalive_connections=200)
+_http_client = httpx.Client(http2=True, limits=_http_limits)
+_http_async_client = httpx.AsyncClient(http2=True, limits=_http_limits)
+
 # Initialize LLM 
-llm = init_chat_model("openai/gpt-oss-20b", model_provider="groq")
+llm = ChatGroq(
+    model="openai/gpt-oss-20b",
+    http_client=_http_client,
+    http_async_client=_http_async_client
+)
+
+# Chat history per session token and scope. Chains are cached and shared,
+# so memory is kept here instead of being attached to the chain.
+# Recent turns are kept verbatim; older ones are folded into a running
+# summary so the prompt stays bounded on long sessions.
+# Bounded and expiring, so abandoned sessions don't pile up; every access
+# re-inserts the entry, which restarts its idle timer.
+SESSION_MEMORY_TTL = 2 * 3600
+_session_memories = TTLCache(maxsize=10_000, ttl=SESSION_MEMORY_TTL)
+
+def get_session_memory(session_token: str, scope: str):
+    scopes = _session_memories.get(session_token) or {}
+    _session_memories[session_token] = scopes
+    if scope not in scopes:
+        scopes[scope] = ConversationSummaryBufferMemory(
+            llm=llm,
+            max_token_limit=1024,
+            memory_key="chat_history",
+            return_messages=True,
+            output_key="answer"
+        )
+    return scopes[scope]
+
+def clear_session_memory(session_token: str):
+    _session_memories.pop(session_token, None)
+
+# Tag carried by the answering LLM so its tokens can be picked out of the
+# event stream (the question-condensing step uses the same model untagged)
+ANSWER_TAG = "answer"
+
+# Run a (shared) conversational chain with the caller's own chat history,
+# yielding answer tokens as the LLM produces them
+async def astream_answer(chain, question: str, memory):
+    history = await memory.aload_memory_variables({})
+    inputs = {"question": question, "chat_history": history["chat_history"]}
+
+    answer = []
+    async for event in chain.astream_events(inputs, version="v2"):
+        if event["event"] == "on_chat_model_stream" and ANSWER_TAG in event.get("tags", []):
+            token = event["data"]["chunk"].content
+            if token:
+                answer.append(token)
+                yield token
+
+    await memory.asave_context({"question": question}, {"answer": "".join(answer)})
+
+# Written into the stream when the answer fails after tokens were already sent
+# (the 200 status is gone by then); the chat pages display it as-is
+STREAM_ERROR_MARKER = "\n\n[Error] "
+
+# Start an answer stream for a StreamingResponse. The first token is awaited
+# here, so failures before any output (retrieval, LLM connection, auth) raise
+# to the caller and can still become a 500; a failure mid-answer is logged
+# and reported in-stream with STREAM_ERROR_MARKER.
+async def start_answer_stream(chain, question: str, memory):
+    tokens = astream_answer(chain, question, memory)
+    try:
+        first = await tokens.__anext__()
+    except StopAsyncIteration:
+        first = ""
+
+    async def stream():
+        if first:
+            yield first
+        try:
+            async for token in tokens:
+                yield token
+        except Exception as e:
+            logger.exception("Answer stream failed mid-response")
+            yield STREAM_ERROR_MARKER + str(e)
+
+    return stream()
 
 # Conversational Chain
 def conversational_chain(retriever):
-    memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        return_messages=True,
-        output_key="answer"
-    )
-
     prompt_template = """
     You are an enterprise-grade Document Intelligence Assistant for large organizations. 
     Your role is to answer user questions using only the provided document context.
@@ -74,9 +153,9 @@ def conversational_chain(retriever):
     )
 
     chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
+        llm=llm.with_config(tags=[ANSWER_TAG]),
+        condense_question_llm=llm,
         retriever=retriever,
-        memory=memory,
         combine_docs_chain_kwargs={"prompt": prompt},
         return_source_documents=True,
         verbose=False
@@ -85,7 +164,8 @@ def conversational_chain(retriever):
 
 # Extract PDF Document Topic Name 
 def extract_name_from_pdf(documents):
-    full_text = " ".join([doc.page_content for doc in documents])
+    # The title is almost always on the first pages; don't send the whole PDF
+    full_text = " ".join(doc.page_content for doc in documents[:2])[:4000]
 
     prompt = ChatPromptTemplate.from_messages([
         ("system", "You are an expert at reading a document and generating a short, accurate name for it. "
@@ -93,44 +173,27 @@ def extract_name_from_pdf(documents):
         ("user", "Document text:\n{text}\n\nOutput ONLY the name. No reasoning, no explanation, no punctuation except inside the name.")
     ])
 
-    llm_local = init_chat_model("openai/gpt-oss-20b", model_provider="groq")
-
     parser = StrOutputParser()
-    chain = prompt | llm_local | parser
+    chain = prompt | llm | parser
     name = chain.invoke({"text": full_text}).strip()
     return name
 
 # Projet plan
-def build_project_plan(
-    domain: str,
-    project_name: str,
-    no_project_members: str,
-    project_members: str,
-    techstack_tools: str,
-    project_description: str,
-):
-    """
-    Generates a comprehensive project plan based on inputs using a structured LLM chain.
-    """
-
-    # 1. Initialize model
-    model = init_chat_model("openai/gpt-oss-20b", model_provider="groq")
+# Output schema for dashboard
+class ProjectPlan(BaseModel):
+    project_overview: str = Field(description="Summary of the project in simple terms")
+    team_structure: Dict[str, str] = Field(description="Roles and responsibilities of each member")
+    roadmap: List[str] = Field(description="Step-by-step roadmap for building the project")
+    tools_and_practices: List[str] = Field(description="Best practices, recommended tools, and workflows")
+    risks: List[str] = Field(description="Potential risks and pitfalls to watch for")
+    next_steps: List[str] = Field(description="Immediate next steps for the team")
+    timeline: Dict[str, str] = Field(description="Timeline broken down by phase or milestone, with estimated durations")
+    sources: List[str] = Field(description="Recommended references, tutorials, documentation, and learning material")
 
-    # 2. Define output schema for dashboard
-    class ProjectPlan(BaseModel):
-        project_overview: str = Field(description="Summary of the project in simple terms")
-        team_structure: Dict[str, str] = Field(description="Roles and responsibilities of each member")
-        roadmap: List[str] = Field(description="Step-by-step roadmap for building the project")
-        tools_and_practices: List[str] = Field(description="Best practices, recommended tools, and workflows")
-        risks: List[str] = Field(description="Potential risks and pitfalls to watch for")
-        next_steps: List[str] = Field(description="Immediate next steps for the team")
-        timeline: Dict[str, str] = Field(description="Timeline broken down by phase or milestone, with estimated durations")
-        sources: List[str] = Field(description="Recommended references, tutorials, documentation, and learning material")
 
-    parser = PydanticOutputParser(pydantic_object=ProjectPlan)
+project_plan_parser = PydanticOutputParser(pydantic_object=ProjectPlan)
 
-    # 3. Improved system prompt
-    prompt_template = """
+project_plan_template = """
     You are an expert in the {domain} domain with 10 years of proven industry experience.
     Your mission is to act as a **senior mentor and advisor** for the project team.
 
@@ -165,29 +228,26 @@ def build_project_plan(
     {format_instructions}
     """
 
-    # 4. Create prompt
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", prompt_template),
-    ])
+# Format instructions never change, so bake them into the prompt once
+project_plan_prompt = ChatPromptTemplate.from_messages([
+    ("system", project_plan_template),
+]).partial(format_instructions=project_plan_parser.get_format_instructions())
 
-    # 5. Build chain
-    chain = (
-        {
-            "domain": RunnablePassthrough(),
-            "project_name": RunnablePassthrough(),
-            "no_project_members": RunnablePassthrough(),
-            "project_members": RunnablePassthrough(),
-            "techstack/tools": RunnablePassthrough(),
-            "project_description": RunnablePassthrough(),
-            "format_instructions": lambda _: parser.get_format_instructions(),
-        }
-        | prompt
-        | model
-        | parser
-    )
+project_plan_chain = project_plan_prompt | llm | project_plan_parser
 
-    # 6. Run chain with provided inputs
-    result = chain.invoke({
+
+async def build_project_plan(
+    domain: str,
+    project_name: str,
+    no_project_members: str,
+    project_members: str,
+    techstack_tools: str,
+    project_description: str,
+):
+    """
+    Generates a comprehensive project plan based on inputs using a structured LLM chain.
+    """
+    result = await project_plan_chain.ainvoke({
         "domain": domain,
         "project_name": project_name,
         "no_project_members": no_project_members,
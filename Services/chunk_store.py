@@ -0,0 +1,179 @@
+import json
+import re
+import sqlite3
+import threading
+
+from langchain_core.documents import Document
+
+# SQLite FTS5 keyword index over the same chunks stored in Chroma.
+# One FTS table per Chroma collection keeps each company/team/project isolated.
+# The same database also holds the (un-embedded) parent chunks, keyed by
+# parent_chunk_id, that child hits are expanded to at query time, and a
+# per-collection generation counter that every ingest bumps.
+DATABASE_PATH = "./chunk_store.db"
+PARENT_TABLE = "parent_chunks"
+GENERATION_TABLE = "collection_generations"
+
+_conn = None
+_conn_lock = threading.Lock()
+_known_tables = set()
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+    return _conn
+
+
+# Each FTS table has a companion "<table>_ids" table with chunk_id as its
+# primary key: FTS5 can't enforce uniqueness itself, so indexing a chunk
+# claims its id there first and skips it if it is already taken.
+def _ensure_table(conn, collection_name: str):
+    table = f"fts_{collection_name}"
+    if table not in _known_tables:
+        with conn:
+            conn.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS "{table}" '
+                "USING fts5(page_content, chunk_id UNINDEXED, metadata UNINDEXED)"
+            )
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}_ids" (chunk_id TEXT PRIMARY KEY)')
+            # FTS tables written before the id table existed
+            conn.execute(f'INSERT OR IGNORE INTO "{table}_ids" (chunk_id) SELECT chunk_id FROM "{table}"')
+        _known_tables.add(table)
+    return table
+
+
+def _ensure_parent_table(conn):
+    if PARENT_TABLE not in _known_tables:
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS "{PARENT_TABLE}" '
+            "(parent_chunk_id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        _known_tables.add(PARENT_TABLE)
+    return PARENT_TABLE
+
+
+def _ensure_generation_table(conn):
+    if GENERATION_TABLE not in _known_tables:
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS "{GENERATION_TABLE}" '
+            "(collection_name TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+        _known_tables.add(GENERATION_TABLE)
+    return GENERATION_TABLE
+
+
+# Turn free text into an FTS5 query: quote every word and OR them, so user
+# input can never be parsed as FTS syntax
+def _match_query(text: str):
+    terms = re.findall(r"\w+", text)
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def add_chunks(collection_name: str, chunk_ids, documents):
+    """
+    Indexes the chunks; ids already in the collection's index are skipped,
+    so re-adding the same chunks (e.g. racing uploads) is a no-op.
+    """
+    with _conn_lock:
+        conn = _get_conn()
+        table = _ensure_table(conn, collection_name)
+        with conn:
+            for chunk_id, doc in zip(chunk_ids, documents):
+                claimed = conn.execute(
+                    f'INSERT OR IGNORE INTO "{table}_ids" (chunk_id) VALUES (?)', (chunk_id,)
+                ).rowcount
+                if claimed:
+                    conn.execute(
+                        f'INSERT INTO "{table}" (page_content, chunk_id, metadata) VALUES (?, ?, ?)',
+                        (doc.page_content, chunk_id, json.dumps(doc.metadata))
+                    )
+
+
+def add_parents(documents, extra_metadata=None):
+    """
+    Stores parent chunks keyed by their metadata["parent_chunk_id"].
+    `extra_metadata` (scope ids, source, ...) is merged into each one.
+    """
+    extra_metadata = extra_metadata or {}
+    rows = [
+        (doc.metadata["parent_chunk_id"], doc.page_content, json.dumps({**doc.metadata, **extra_metadata}))
+        for doc in documents
+    ]
+    with _conn_lock:
+        conn = _get_conn()
+        table = _ensure_parent_table(conn)
+        with conn:
+            conn.executemany(
+                f'INSERT OR REPLACE INTO "{table}" (parent_chunk_id, page_content, metadata) VALUES (?, ?, ?)',
+                rows
+            )
+
+
+def get_parents(parent_chunk_ids):
+    """
+    Returns {parent_chunk_id: Document} for the ids that exist.
+    """
+    parent_chunk_ids = list(parent_chunk_ids)
+    if not parent_chunk_ids:
+        return {}
+
+    placeholders = ", ".join("?" * len(parent_chunk_ids))
+    with _conn_lock:
+        conn = _get_conn()
+        table = _ensure_parent_table(conn)
+        rows = conn.execute(
+            f'SELECT parent_chunk_id, page_content, metadata FROM "{table}" '
+            f"WHERE parent_chunk_id IN ({placeholders})",
+            parent_chunk_ids
+        ).fetchall()
+
+    return {
+        parent_chunk_id: Document(page_content=content, metadata=json.loads(metadata))
+        for parent_chunk_id, content, metadata in rows
+    }
+
+
+# The generation lives in the database rather than in process memory, so
+# every uvicorn worker sees an ingest done by any other one
+def get_generation(collection_name: str) -> int:
+    with _conn_lock:
+        conn = _get_conn()
+        table = _ensure_generation_table(conn)
+        row = conn.execute(
+            f'SELECT generation FROM "{table}" WHERE collection_name = ?', (collection_name,)
+        ).fetchone()
+    return row[0] if row else 0
+
+
+def bump_generation(collection_name: str):
+    with _conn_lock:
+        conn = _get_conn()
+        table = _ensure_generation_table(conn)
+        with conn:
+            conn.execute(
+                f'INSERT INTO "{table}" (collection_name, generation) VALUES (?, 1) '
+                "ON CONFLICT(collection_name) DO UPDATE SET generation = generation + 1",
+                (collection_name,)
+            )
+
+
+def keyword_search(collection_name: str, query: str, limit: int = 20):
+    """
+    Returns up to `limit` chunks of the collection ranked by BM25.
+    """
+    match = _match_query(query)
+    if not match:
+        return []
+
+    with _conn_lock:
+        conn = _get_conn()
+        table = _ensure_table(conn, collection_name)
+        rows = conn.execute(
+            f'SELECT page_content, metadata FROM "{table}" '
+            f'WHERE "{table}" MATCH ? ORDER BY rank LIMIT ?',
+            (match, limit)
+        ).fetchall()
+
+    return [Document(page_content=content, metadata=json.loads(metadata)) for content, metadata in rows]
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import onnxruntime
+from langchain_core.embeddings import Embeddings
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+MODEL_DIR = "./onnx_models/all-MiniLM-L6-v2-int8"
+
+
+# Export MiniLM to ONNX and quantize its weights to int8 (dynamic quantization,
+# VNNI kernels); done once, later starts load the saved model
+def _export_quantized(model_id: str, model_dir: str):
+    model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    quantizer.quantize(
+        save_dir=model_dir,
+        quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    )
+    AutoTokenizer.from_pretrained(model_id).save_pretrained(model_dir)
+
+
+class OnnxMiniLMEmbeddings(Embeddings):
+    """
+    all-MiniLM-L6-v2 running on ONNX Runtime with int8 weights.
+    Mean pooling + L2 normalization reproduce the sentence-transformers output.
+    """
+
+    def __init__(self, model_id: str = MODEL_ID, model_dir: str = MODEL_DIR, batch_size: int = 64):
+        if not os.path.isdir(model_dir):
+            _export_quantized(model_id, model_dir)
+
+        session_options = onnxruntime.SessionOptions()
+        # main.py sizes OMP_NUM_THREADS to this worker's share of the cores
+        session_options.intra_op_num_threads = int(os.environ.get("OMP_NUM_THREADS", os.cpu_count()))
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir,
+            file_name="model_quantized.onnx",
+            session_options=session_options
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+
+    # Like SentenceTransformer.encode, texts are batched longest-first so each
+    # batch is padded only to members of similar length; vectors are returned
+    # in input order
+    def _embed(self, texts):
+        if not texts:
+            return []
+        lengths = self.tokenizer(texts, truncation=True, max_length=256, return_length=True)["length"]
+        order = np.argsort([-length for length in lengths], kind="stable")
+
+        vectors = [None] * len(texts)
+        for start in range(0, len(texts), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                [texts[i] for i in batch],
+                padding=True,
+                truncation=True,
+                max_length=256,
+                return_tensors="np"
+            )
+            hidden = self.model(**inputs).last_hidden_state
+
+            # mean over real (non-padding) tokens, then unit length
+            mask = inputs["attention_mask"][..., None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, vector in zip(batch, pooled.tolist()):
+                vectors[i] = vector
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts))
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
@@ -1,8 +1,36 @@
-from langchain_community.document_loaders import PyPDFLoader
+import fitz  # PyMuPDF
+import pdfplumber
+from langchain_core.documents import Document
+
+
+# A page whose text blocks line up side by side on several rows is most
+# likely a table, which PyMuPDF's plain-text mode flattens badly
+def _looks_tabular(page, min_columns=3, min_rows=3):
+    rows = {}
+    for block in page.get_text("blocks"):
+        row = round(block[1])
+        rows[row] = rows.get(row, 0) + 1
+    return sum(1 for count in rows.values() if count >= min_columns) >= min_rows
+
 
 def document_validator(file_path):
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
+    documents = []
+    plumber_pdf = None
+    try:
+        with fitz.open(file_path) as pdf:
+            for i, page in enumerate(pdf):
+                if _looks_tabular(page):
+                    # pdfplumber keeps table columns aligned; open it only when needed
+                    if plumber_pdf is None:
+                        plumber_pdf = pdfplumber.open(file_path)
+                    text = plumber_pdf.pages[i].extract_text(layout=True) or ""
+                else:
+                    text = page.get_text("text")
+                documents.append(Document(page_content=text, metadata={"source": file_path, "page": i}))
+    finally:
+        if plumber_pdf is not None:
+            plumber_pdf.close()
+
     if not documents:
         raise ValueError("No documents were loaded. Check the file path or PDF content.")
     return documents
\ No newline at end of file
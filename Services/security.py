@@ -0,0 +1,33 @@
+import hmac
+
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+
+# One hasher per process; argon2-cffi does the hashing in C
+_password_hasher = PasswordHasher()
+
+
+def hash_password(password: str) -> str:
+    return _password_hasher.hash(password)
+
+
+def verify_password(stored: str, password: str) -> bool:
+    """
+    Constant-time check of `password` against a stored argon2 hash.
+    Rows created before hashing was introduced still hold the plain
+    password; those are compared with hmac.compare_digest.
+    """
+    try:
+        return _password_hasher.verify(stored, password)
+    except InvalidHashError:
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+    except VerificationError:
+        return False
+
+
+def password_needs_rehash(stored: str) -> bool:
+    # True for legacy plain-text rows and for hashes made with older parameters
+    try:
+        return _password_hasher.check_needs_rehash(stored)
+    except InvalidHashError:
+        return True
@@ -1,182 +1,642 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from cachetools import LRUCache, TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from chromadb.config import Settings
+import chromadb
+from transformers import AutoTokenizer
+import asyncio
+import functools
+import hashlib
+import numpy as np
+import os
+import threading
 import uuid
+import xxhash
 
+from Services.chunk_store import add_chunks, add_parents, bump_generation, get_generation, get_parents, keyword_search
 
-def get_embeddings():
-    return HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={"device": "cpu"}
-    )
+try:
+    from Services.onnx_embeddings import OnnxMiniLMEmbeddings
+except ImportError:  # optimum / onnxruntime not installed
+    OnnxMiniLMEmbeddings = None
 
+try:
+    import numba
+except ImportError:  # MMR selection falls back to NumPy
+    numba = None
 
-# --------------------- COMPANY VECTORSTORE ---------------------
 
+# Dedicated, bounded pool for the CPU-bound vector work (splitting, encoding,
+# HNSW search, Chroma/FTS writes), so it neither waits behind nor starves the
+# default executor that FastAPI and asyncio.to_thread share. Sized to this
+# worker's share of the cores (main.py puts it in OMP_NUM_THREADS), so N
+# uvicorn workers don't each start a pool as large as the whole machine.
+CPU_POOL_WORKERS = int(
+    os.environ.get("CPU_POOL_WORKERS")
+    or os.environ.get("OMP_NUM_THREADS")
+    or os.cpu_count()
+    or 4
+)
+_CPU_POOL = ThreadPoolExecutor(max_workers=CPU_POOL_WORKERS, thread_name_prefix="vector-cpu")
 
-# Add documents (PDF) to a company-scoped Chroma collection (called at upload time)
-def add_documents_to_collection(company_id: str, documents, file_name: str = None):
+
+async def run_in_cpu_pool(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(_CPU_POOL, functools.partial(fn, *args, **kwargs))
+
+
+# Query embeddings shared across every company/team/project scope,
+# keyed by the SHA-256 of the query text. Vectors are held as float32 numpy
+# arrays (1.5 KB each, ~15 MB for a full cache, versus ~12 KB each as a list
+# of Python floats). float16 would save only ~7.5 MB more, and it would make a
+# cache hit rank slightly differently from a miss for the same question.
+_query_embedding_cache = TTLCache(maxsize=10_000, ttl=3600)
+_query_embedding_lock = threading.Lock()
+
+
+class CachedQueryEmbeddings(Embeddings):
     """
-    - Splits `documents` into child chunks,
-    - tags each chunk with metadata: company_id, parent_id, source (file_name),
-    - adds them to Chroma collection: `company_{company_id}_chunks`.
-    Returns generated parent_id for reference.
+    Wraps an embeddings model so repeated chat questions are embedded once.
+    Document embedding is passed straight through.
     """
-    # Use a child splitter (fine-grained chunks)
-    child_splitter = RecursiveCharacterTextSplitter(chunk_size=400, chunk_overlap=100)
-    child_docs = child_splitter.split_documents(documents)
 
-    parent_id = str(uuid.uuid4())
-    for d in child_docs:
-        # tag metadata so retrieval can be filtered or used by LLM
-        d.metadata["company_id"] = str(company_id)
-        d.metadata["parent_id"] = parent_id
-        if file_name:
-            d.metadata["source"] = file_name
-
-    embeddings = get_embeddings()
-    collection_name = f"company_{company_id}_chunks"
-
-    # Chroma client pointing to the shared persist directory; collection isolates per-company data
-    vectorstore = Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory="./chroma_store"
-    )
-
-    # add_documents appends; it doesn't clobber other collections
-    vectorstore.add_documents(child_docs)
-
-    # persist to disk so the collection survives restarts
-    try:
-        vectorstore.persist()
-    except Exception:
-        # some chroma installs persist automatically; ignore if not available
-        pass
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
 
-    return parent_id
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
 
-# Build a retriever scoped to a specific company collection
-def get_retriever_for_company(company_id: str, k: int = 5, fetch_k: int = 20):
+    def embed_query(self, text):
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with _query_embedding_lock:
+            cached = _query_embedding_cache.get(key)
+        if cached is None:
+            cached = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            with _query_embedding_lock:
+                _query_embedding_cache[key] = cached
+        return cached.tolist()
+
+
+# Chunks per model forward pass. The EmbeddingBatcher below hands the model
+# up to this many chunks per embed_documents call, which encodes them as one
+# vectorized batch (both the ONNX model and sentence-transformers sort the
+# inputs by length first, so a batch is padded only to similar lengths).
+EMBED_BATCH_SIZE = 64
+
+
+# Loaded once per process; every add/retrieve call shares the same model.
+# Prefers the int8 ONNX Runtime build of MiniLM and falls back to the
+# PyTorch sentence-transformers model when optimum isn't installed.
+@functools.lru_cache(maxsize=1)
+def get_embeddings():
+    if OnnxMiniLMEmbeddings is not None:
+        return CachedQueryEmbeddings(OnnxMiniLMEmbeddings(batch_size=EMBED_BATCH_SIZE))
+
+    return CachedQueryEmbeddings(HuggingFaceEmbeddings(
+        model_name=EMBED_MODEL_ID,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"batch_size": EMBED_BATCH_SIZE, "normalize_embeddings": True}
+    ))
+
+
+# Collects the chunks of every upload being ingested at the same moment into
+# shared embed_documents batches: a batch is sent as soon as it holds
+# `max_batch` texts, or `max_wait` seconds after its first text arrived.
+# Concurrent uploads then share forward passes instead of queueing behind
+# each other's model calls. The encode itself runs in a worker thread.
+class EmbeddingBatcher:
+    def __init__(self, max_batch: int = EMBED_BATCH_SIZE, max_wait: float = 0.02):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = None
+        self._task = None
+        self._loop = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def embed(self, texts):
+        self.start()
+        futures = []
+        for text in texts:
+            future = self._loop.create_future()
+            self._queue.put_nowait((text, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                vectors = await run_in_cpu_pool(get_embeddings().embed_documents, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+
+embedding_batcher = EmbeddingBatcher()
+
+
+# Chunks are sized in MiniLM tokens rather than characters, so none overflow
+# the model's 256-token window (and get silently truncated). The tokenizer
+# and splitter are built once at import and shared by every ingestion call.
+EMBED_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 20
+MIN_CHUNK_TOKENS = 50
+# The model's 256-token window includes [CLS] and [SEP], while chunk lengths
+# here (and in the splitter) count content tokens only, so two are reserved.
+EMBED_MAX_SEQ_LENGTH = 256
+MAX_CHUNK_TOKENS = EMBED_MAX_SEQ_LENGTH - 2
+
+_TOKENIZER = AutoTokenizer.from_pretrained(EMBED_MODEL_ID)
+_CHILD_SPLITTER = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+    _TOKENIZER,
+    chunk_size=CHUNK_TOKENS,
+    chunk_overlap=CHUNK_OVERLAP_TOKENS
+)
+
+
+def _token_len(text: str) -> int:
+    return len(_TOKENIZER.encode(text, add_special_tokens=False))
+
+
+# Split pages into chunks, folding any chunk under MIN_CHUNK_TOKENS into a
+# neighbour from the same page (the previous one, else the next one), since
+# tiny fragments make context-poor hits. A fragment that would push its
+# neighbour past MAX_CHUNK_TOKENS is kept on its own instead.
+def split_into_chunks(documents):
+    chunks = []
+    carry = None
+    for d in _CHILD_SPLITTER.split_documents(documents):
+        if carry is not None:
+            merged = carry.page_content + "\n" + d.page_content
+            if carry.metadata == d.metadata and _token_len(merged) <= MAX_CHUNK_TOKENS:
+                d.page_content = merged
+            else:
+                chunks.append(carry)
+            carry = None
+
+        if _token_len(d.page_content) < MIN_CHUNK_TOKENS:
+            if chunks and chunks[-1].metadata == d.metadata:
+                merged = chunks[-1].page_content + "\n" + d.page_content
+                if _token_len(merged) <= MAX_CHUNK_TOKENS:
+                    chunks[-1].page_content = merged
+                    continue
+            carry = d
+            continue
+
+        chunks.append(d)
+
+    if carry is not None:
+        chunks.append(carry)
+    return chunks
+
+
+# Small-to-big chunking: pages are split into ~1500-char parent chunks, which
+# are stored un-embedded in the chunk store, and each parent is split into
+# the small child chunks that actually get embedded. Every child carries its
+# parent's parent_chunk_id (distinct from parent_id, which identifies the
+# uploaded file) so retrieval can hand the LLM the wider parent passage.
+_PARENT_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150)
+
+
+def split_parent_child(documents):
+    parent_docs = _PARENT_SPLITTER.split_documents(documents)
+    for parent in parent_docs:
+        parent.metadata["parent_chunk_id"] = str(uuid.uuid4())
+    # children inherit the parent's metadata, parent_chunk_id included
+    child_docs = [child for parent in parent_docs for child in split_into_chunks([parent])]
+    return parent_docs, child_docs
+
+
+# Replace child hits with their parent chunks, keeping rank order and
+# returning each parent once. Chunks without a stored parent (collections
+# ingested before parent chunks existed) are returned as-is.
+def expand_to_parents(child_docs):
+    parents = get_parents({
+        d.metadata["parent_chunk_id"] for d in child_docs if d.metadata.get("parent_chunk_id")
+    })
+    results = []
+    seen = set()
+    for d in child_docs:
+        parent_chunk_id = d.metadata.get("parent_chunk_id")
+        if parent_chunk_id not in parents:
+            results.append(d)
+        elif parent_chunk_id not in seen:
+            seen.add(parent_chunk_id)
+            results.append(parents[parent_chunk_id])
+    return results
+
+
+# Greedy MMR selection given the query similarities `sim_q` and the
+# candidate-candidate matrix `sim_cc`: each of the k picks is a single
+# masked argmax. Returns candidate indices in selection order.
+def _mmr_select_numpy(sim_q, sim_cc, k, lambda_mult):
+    first = int(np.argmax(sim_q))
+    selected = [first]
+    available = np.ones(len(sim_q), dtype=bool)
+    available[first] = False
+    # each candidate's highest similarity to anything already selected
+    sim_selected = sim_cc[first].copy()
+
+    for _ in range(k - 1):
+        scores = lambda_mult * sim_q - (1 - lambda_mult) * sim_selected
+        scores[~available] = -np.inf
+        idx = int(np.argmax(scores))
+        selected.append(idx)
+        available[idx] = False
+        np.maximum(sim_selected, sim_cc[idx], out=sim_selected)
+    return np.array(selected, dtype=np.int64)
+
+
+# The same selection as plain loops, compiled to native code when numba is
+# installed (cached on disk, so only the first process start pays the JIT).
+# fastmath is limited to the reassociation/contraction flags: the full set
+# includes ninf/nnan, which would let LLVM assume the -inf sentinel below
+# never occurs.
+_MMR_FASTMATH = {"nsz", "arcp", "contract", "reassoc"}
+
+
+def _mmr_select_loops(sim_q, sim_cc, k, lambda_mult):
+    n = sim_q.shape[0]
+    selected = np.empty(k, dtype=np.int64)
+    available = np.ones(n, dtype=np.bool_)
+    sim_selected = np.empty(n, dtype=np.float32)
+
+    first = 0
+    for i in range(1, n):
+        if sim_q[i] > sim_q[first]:
+            first = i
+    selected[0] = first
+    available[first] = False
+    for i in range(n):
+        sim_selected[i] = sim_cc[first, i]
+
+    for s in range(1, k):
+        best = -1
+        best_score = -np.inf
+        for i in range(n):
+            if available[i]:
+                score = lambda_mult * sim_q[i] - (1 - lambda_mult) * sim_selected[i]
+                if score > best_score:
+                    best = i
+                    best_score = score
+        selected[s] = best
+        available[best] = False
+        for i in range(n):
+            if sim_cc[best, i] > sim_selected[i]:
+                sim_selected[i] = sim_cc[best, i]
+    return selected
+
+
+if numba is not None:
+    _mmr_select = numba.njit(cache=True, fastmath=_MMR_FASTMATH)(_mmr_select_loops)
+else:
+    _mmr_select = _mmr_select_numpy
+
+
+# Maximal marginal relevance over `fetch_k` candidates: the query and
+# candidate-candidate similarities are computed once (vectorized), then
+# _mmr_select picks k of them. Returns candidate indices in selection order.
+# Vectors come from get_embeddings() and are already unit length, so plain
+# dot products are the cosine similarities.
+def mmr_vectorized(query_emb, cand_embs, k: int, lambda_mult: float = 0.5):
+    cands = np.asarray(cand_embs, dtype=np.float32)
+    if len(cands) == 0:
+        return []
+    query = np.asarray(query_emb, dtype=np.float32)
+
+    sim_q = cands @ query
+    sim_cc = np.einsum("ij,kj->ik", cands, cands)
+
+    return _mmr_select(sim_q, sim_cc, min(k, len(cands)), np.float32(lambda_mult)).tolist()
+
+
+class NumpyMMRRetriever(VectorStoreRetriever):
+    """
+    MMR retriever for a Chroma store that fetches the `fetch_k` nearest
+    chunks together with their stored embeddings in one query and runs
+    mmr_vectorized on them, instead of LangChain's per-candidate loop.
+    """
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        k = self.search_kwargs.get("k", 4)
+        fetch_k = self.search_kwargs.get("fetch_k", 20)
+        lambda_mult = self.search_kwargs.get("lambda_mult", 0.5)
+
+        query_emb = self.vectorstore.embeddings.embed_query(query)
+        results = self.vectorstore._collection.query(
+            query_embeddings=[query_emb],
+            n_results=fetch_k,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        texts = results["documents"][0]
+        if not texts:
+            return []
+
+        metadatas = results["metadatas"][0]
+        picks = mmr_vectorized(query_emb, results["embeddings"][0], k, lambda_mult)
+        return [Document(page_content=texts[i], metadata=metadatas[i] or {}) for i in picks]
+
+
+# Merge several ranked result lists: each doc scores sum(1 / (rrf_k + rank))
+def reciprocal_rank_fusion(result_lists, k: int = 5, rrf_k: int = 60):
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc.metadata.get("chunk_id") or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ranked[:k]]
+
+
+# Retrieval results for repeated questions, keyed by
+# (collection, generation, k, fetch_k, query). Each ingest into a collection
+# bumps its generation in the chunk store (shared by every worker process),
+# so stale results simply stop being hit and age out.
+# Query embeddings are cached separately (and shared by every scope) in
+# CachedQueryEmbeddings.
+_retrieval_cache = LRUCache(maxsize=1024)
+_retrieval_lock = threading.Lock()
+
+
+class HybridRetriever(BaseRetriever):
     """
-    Returns an MMR retriever that searches only the company's collection.
+    Dense MMR retrieval from Chroma plus BM25 keyword retrieval from the
+    FTS5 chunk store, fused with reciprocal rank fusion. Keyword search
+    catches exact names, filenames and IDs that embeddings tend to miss.
+    The fused child chunks are then expanded to their parent chunks.
+    Results are LRU-cached per collection until its next ingest. The async
+    path (used by the streaming chat chain) reads the generation in a
+    thread and runs cache misses on the CPU pool.
     """
-    embeddings = get_embeddings()
-    collection_name = f"company_{company_id}_chunks"
-
-    vectorstore = Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory="./chroma_store"
-    )
-
-    retriever = vectorstore.as_retriever(
-        search_type="mmr",
-        search_kwargs={"k": k, "fetch_k": fetch_k}
-    )
+    dense_retriever: BaseRetriever
+    collection_name: str
+    k: int = 5
+    fetch_k: int = 20
+
+    def _lookup(self, query: str):
+        key = (self.collection_name, get_generation(self.collection_name), self.k, self.fetch_k, query)
+        with _retrieval_lock:
+            return key, _retrieval_cache.get(key)
+
+    def _retrieve(self, query: str, key, callbacks=None):
+        dense_docs = self.dense_retriever.invoke(query, config={"callbacks": callbacks})
+        keyword_docs = keyword_search(self.collection_name, query, limit=self.fetch_k)
+        docs = expand_to_parents(reciprocal_rank_fusion([dense_docs, keyword_docs], k=self.k))
+
+        with _retrieval_lock:
+            _retrieval_cache[key] = docs
+        return list(docs)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        key, cached = self._lookup(query)
+        if cached is not None:
+            return list(cached)
+        return self._retrieve(query, key, run_manager.get_child())
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun):
+        # a sqlite read; kept off the loop but out of the (busier) CPU pool
+        key, cached = await asyncio.to_thread(self._lookup, query)
+        if cached is not None:
+            return list(cached)
+        # query embedding, HNSW search and the FTS query all block
+        return await run_in_cpu_pool(self._retrieve, query, key)
+
+
+# HNSW settings for new collections, sized for fetch_k=20 MMR queries:
+# a denser graph (M=32, construction_ef=200) built once per chunk, and
+# search_ef=64 so a single search returns all fetch_k candidates at good
+# recall. Embeddings are L2-normalized at encode time, so inner product is
+# exactly cosine similarity at one dot product per comparison. Chroma only
+# applies these when a collection is first created.
+HNSW_METADATA = {
+    "hnsw:space": "ip",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
+
+# all-MiniLM-L6-v2 output size; every collection's index is built for it
+EMBEDDING_DIM = 384
+
+
+# Called once at startup: embeds a probe string, which also loads the model,
+# and fails fast if the model doesn't produce EMBEDDING_DIM-sized vectors
+def check_embedding_dim():
+    dim = len(get_embeddings().embed_query("x"))
+    if dim != EMBEDDING_DIM:
+        raise RuntimeError(f"Embedding model returns {dim}-d vectors, collections expect {EMBEDDING_DIM}")
+    return dim
+
+
+# One persistent Chroma client (one sqlite connection, one settings load) for
+# every collection. It writes through to disk on each add, so no persist()
+# call is needed.
+_CHROMA_CLIENT = chromadb.PersistentClient(
+    path="./chroma_store",
+    settings=Settings(anonymized_telemetry=False)
+)
+
+# One Chroma handle (and one retriever per k/fetch_k) per collection for the
+# life of the process, instead of reopening the store on every call
+_VS_CACHE = {}
+_RETRIEVER_CACHE = {}
+_VS_LOCK = threading.Lock()
+
+
+def _get_vs(collection_name: str):
+    with _VS_LOCK:
+        vectorstore = _VS_CACHE.get(collection_name)
+        if vectorstore is None:
+            vectorstore = Chroma(
+                collection_name=collection_name,
+                embedding_function=get_embeddings(),
+                client=_CHROMA_CLIENT,
+                collection_metadata=HNSW_METADATA
+            )
+            _VS_CACHE[collection_name] = vectorstore
+    return vectorstore
+
+
+def _hybrid_retriever(collection_name: str, k: int, fetch_k: int):
+    key = (collection_name, k, fetch_k)
+    retriever = _RETRIEVER_CACHE.get(key)
+    if retriever is None:
+        dense_retriever = NumpyMMRRetriever(
+            vectorstore=_get_vs(collection_name),
+            search_type="mmr",
+            search_kwargs={"k": k, "fetch_k": fetch_k}
+        )
+        retriever = HybridRetriever(
+            dense_retriever=dense_retriever,
+            collection_name=collection_name,
+            k=k,
+            fetch_k=fetch_k
+        )
+        with _VS_LOCK:
+            retriever = _RETRIEVER_CACHE.setdefault(key, retriever)
     return retriever
 
 
+# Embed child chunks through the shared batcher, then write them to Chroma
+# (upsert with the precomputed vectors) and the keyword index, store their
+# parents, and invalidate the collection's cached retrieval results
+async def _store_chunks(collection_name: str, chunk_ids, child_docs, parent_docs, base_meta):
+    vectors = await embedding_batcher.embed([d.page_content for d in child_docs])
 
-# --------------------- TEAM VECTORSTORE ---------------------
+    def write():
+        if chunk_ids:
+            _get_vs(collection_name)._collection.upsert(
+                ids=chunk_ids,
+                embeddings=vectors,
+                documents=[d.page_content for d in child_docs],
+                metadatas=[d.metadata for d in child_docs]
+            )
+        add_chunks(collection_name, chunk_ids, child_docs)
+        add_parents(parent_docs, base_meta)
+        bump_generation(collection_name)
 
-# Add docs to team collection
-def add_documents_to_team(company_id : str, team_id: str, documents, file_name: str = None):
-    """
-    - Splits docs into chunks
-    - tags each chunk with metadata: team_id, parent_id, source
-    - stores in Chroma collection: team_{team_id}_chunks
-    """
-    child_splitter = RecursiveCharacterTextSplitter(chunk_size=400, chunk_overlap=100)
-    child_docs = child_splitter.split_documents(documents)
+    await run_in_cpu_pool(write)
 
-    parent_id = str(uuid.uuid4())
-    for d in child_docs:
-        d.metadata['company_id'] = str(company_id)
-        d.metadata["team_id"] = str(team_id)
-        d.metadata["parent_id"] = parent_id
-        if file_name:
-            d.metadata["source"] = file_name
 
-    embeddings = get_embeddings()
-    collection_name = f"team_{team_id}_{company_id}_chunks"
+# Collection name per scope; every scope is keyed by company_id plus, for
+# team and project, its own id. All three scopes share one ingest path and
+# one retriever path below.
+SCOPE_TEMPLATES = {
+    "company": "company_{company_id}_chunks",
+    "team": "team_{team_id}_{company_id}_chunks",
+    "project": "project_{project_id}_company_{company_id}_chunks",
+}
 
 
-    vectorstore = Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory="./chroma_store"
-    )
+def _collection_name(scope: str, ids: dict):
+    return SCOPE_TEMPLATES[scope].format(**ids)
 
-    vectorstore.add_documents(child_docs)
 
-    try:
-        vectorstore.persist()
-    except Exception:
-        pass
+# Chunk ids are content hashes (xxhash64 of the text), so a chunk that is
+# already in the collection (re-uploads, revised or templated PDFs) or
+# repeats within the same file is embedded and stored only once
+def _content_id(text: str):
+    return xxhash.xxh64(text.encode("utf-8")).hexdigest()
 
-    return parent_id
 
-# Retriever for a team
-def get_team_retriever(company_id : str, team_id: str, k: int = 5, fetch_k: int = 20):
-    embeddings = get_embeddings()
-    collection_name = f"team_{team_id}_{company_id}_chunks"
-
-    vectorstore = Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory="./chroma_store"
-    )
-
-    retriever = vectorstore.as_retriever(
-        search_type="mmr",
-        search_kwargs={"k": k, "fetch_k": fetch_k}
-    )
-    return retriever
+def _existing_ids(collection_name: str, chunk_ids):
+    if not chunk_ids:
+        return set()
+    return set(_get_vs(collection_name)._collection.get(ids=chunk_ids, include=[])["ids"])
 
 
-# --------------------- PROJECT VECTORSTORE ---------------------
-def add_documents_to_project(company_id: str, project_id: str, documents, file_name: str = None):
-    # Split docs into chunks
-    child_splitter = RecursiveCharacterTextSplitter(chunk_size=400, chunk_overlap=100)
-    child_docs = child_splitter.split_documents(documents)
+async def _add(scope: str, ids: dict, documents, file_name: str = None, parent_id: str = None):
+    """
+    - Splits `documents` into parent chunks and those into child chunks,
+    - drops chunks whose content hash is already in the collection (or repeats in this file),
+    - tags each chunk with metadata: the scope ids (company_id, team_id / project_id),
+      parent_id, parent_chunk_id, chunk_id (content hash), source (file_name),
+    - adds the children to the scope's Chroma collection (see SCOPE_TEMPLATES)
+      and to the matching keyword index in the chunk store,
+    - stores the parents (un-embedded) in the chunk store.
+    Returns parent_id (generated unless the caller passes one) for reference.
+    """
+    ids = {key: str(value) for key, value in ids.items()}
+    collection_name = _collection_name(scope, ids)
+
+    # Parent chunks for context, token-aware child chunks (fine-grained) for search
+    parent_docs, child_docs = await run_in_cpu_pool(split_parent_child, documents)
 
-    parent_id = str(uuid.uuid4())
+    unique_docs = {}
     for d in child_docs:
-        d.metadata["company_id"] = str(company_id)
-        d.metadata["project_id"] = str(project_id)
-        d.metadata["parent_id"] = parent_id
-        if file_name:
-            d.metadata["source"] = file_name
+        unique_docs.setdefault(_content_id(d.page_content), d)
+    existing = await run_in_cpu_pool(_existing_ids, collection_name, list(unique_docs))
+    chunk_ids = [chunk_id for chunk_id in unique_docs if chunk_id not in existing]
+    child_docs = [unique_docs[chunk_id] for chunk_id in chunk_ids]
+
+    # only parents that still have a child to point at them are worth keeping
+    kept_parents = {d.metadata["parent_chunk_id"] for d in child_docs}
+    parent_docs = [p for p in parent_docs if p.metadata["parent_chunk_id"] in kept_parents]
+
+    parent_id = parent_id or str(uuid.uuid4())
+    # tag metadata so retrieval can be filtered or used by LLM; the shared
+    # part is built once and merged into each new chunk Document
+    base_meta = {
+        **ids,
+        "parent_id": parent_id,
+        **({"source": file_name} if file_name else {})
+    }
+    child_docs = [
+        Document(page_content=d.page_content, metadata={**d.metadata, **base_meta, "chunk_id": chunk_id})
+        for d, chunk_id in zip(child_docs, chunk_ids)
+    ]
+
+    # upsert appends to this collection only; it doesn't clobber other collections.
+    # Chunks are embedded in batches shared with any concurrent uploads.
+    await _store_chunks(collection_name, chunk_ids, child_docs, parent_docs, base_meta)
 
-    embeddings = get_embeddings()
-    collection_name = f"project_{project_id}_company_{company_id}_chunks"
+    return parent_id
 
-    vectorstore = Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory="./chroma_store"
-    )
 
-    vectorstore.add_documents(child_docs)
-    vectorstore.persist()
+# Hybrid (MMR + keyword) retriever that searches only the scope's collection
+def _retriever(scope: str, ids: dict, k: int = 5, fetch_k: int = 20):
+    ids = {key: str(value) for key, value in ids.items()}
+    return _hybrid_retriever(_collection_name(scope, ids), k, fetch_k)
 
-    return parent_id
 
+# --------------------- COMPANY VECTORSTORE ---------------------
 
-def get_project_retriever(company_id: str, project_id: str, k: int = 5, fetch_k: int = 20):
 
-    embeddings = get_embeddings()
-    collection_name = f"project_{project_id}_company_{company_id}_chunks"
+# Add documents (PDF) to a company-scoped Chroma collection (called at upload time)
+async def add_documents_to_collection(company_id: str, documents, file_name: str = None, parent_id: str = None):
+    return await _add("company", {"company_id": company_id}, documents, file_name, parent_id)
 
-    vectorstore = Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory="./chroma_store"
-    )
+# Build a retriever scoped to a specific company collection
+def get_retriever_for_company(company_id: str, k: int = 5, fetch_k: int = 20):
+    return _retriever("company", {"company_id": company_id}, k, fetch_k)
 
-    retriever = vectorstore.as_retriever(
-        search_type="mmr",
-        search_kwargs={"k": k, "fetch_k": fetch_k}
-    )
-    return retriever
+
+
+# --------------------- TEAM VECTORSTORE ---------------------
+
+# Add docs to team collection
+async def add_documents_to_team(company_id : str, team_id: str, documents, file_name: str = None, parent_id: str = None):
+    return await _add("team", {"company_id": company_id, "team_id": team_id}, documents, file_name, parent_id)
+
+# Retriever for a team
+def get_team_retriever(company_id : str, team_id: str, k: int = 5, fetch_k: int = 20):
+    return _retriever("team", {"company_id": company_id, "team_id": team_id}, k, fetch_k)
+
+
+# --------------------- PROJECT VECTORSTORE ---------------------
+async def add_documents_to_project(company_id: str, project_id: str, documents, file_name: str = None, parent_id: str = None):
+    return await _add("project", {"company_id": company_id, "project_id": project_id}, documents, file_name, parent_id)
+
+
+def get_project_retriever(company_id: str, project_id: str, k: int = 5, fetch_k: int = 20):
+    return _retriever("project", {"company_id": company_id, "project_id": project_id}, k, fetch_k)
@@ -1,17 +1,22 @@
+import os
+
+# Give each uvicorn worker an equal share of the cores for embedding, and set
+# the OpenMP/MKL pool sizes before anything imports torch or onnxruntime
+WEB_CONCURRENCY = max(int(os.environ.get("WEB_CONCURRENCY", "1")), 1)
+CPU_THREADS = max((os.cpu_count() or 1) // WEB_CONCURRENCY, 1)
+os.environ.setdefault("OMP_NUM_THREADS", str(CPU_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(CPU_THREADS))
+
 from fastapi import FastAPI
 from Routers.company import router as company_router
 from Routers.team import router as team_router
 from Routers.project import router as project_router
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from Services.vectorstore import check_embedding_dim, embedding_batcher
 
 
 app = FastAPI(title="Document Intelligent System for Companies")
-app.include_router(company_router)
-app.include_router(team_router)
-app.include_router(project_router)
-
-app.mount("/", StaticFiles(directory="frontend", html=True), name="frontend")
 
 # Allow your frontend origin (change origin accordingly)
 app.add_middleware(
@@ -21,3 +26,30 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+
+# Load the embedding model before serving so the first upload/chat doesn't pay for it,
+# and check its output size matches the collections' HNSW indexes
+@app.on_event("startup")
+def preload_embeddings():
+    try:
+        import torch
+        torch.set_num_threads(int(os.environ["OMP_NUM_THREADS"]))
+        torch.set_num_interop_threads(1)
+    except ImportError:
+        pass  # ONNX Runtime build only
+    check_embedding_dim()
+
+
+# Start the embedding batcher that concurrent uploads share
+@app.on_event("startup")
+async def start_embedding_batcher():
+    embedding_batcher.start()
+
+app.include_router(company_router)
+app.include_router(team_router)
+app.include_router(project_router)
+
+# Mounted last: routes match in registration order, so the API routers above
+# are tried before this catch-all serves the frontend
+app.mount("/", StaticFiles(directory="frontend", html=True), name="frontend")
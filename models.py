@@ -1,15 +1,21 @@
 # models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, JSON
+import logging
+
+from sqlalchemy import Column, Integer, String, ForeignKey, JSON, UniqueConstraint, inspect, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship
 from database import Base
 
+logger = logging.getLogger(__name__)
+
 class Team(Base):
     __tablename__ = "team"
+    __table_args__ = (UniqueConstraint("company_id", "team_name"),)
 
     id = Column(Integer, primary_key=True, index=True)  # team_id
-    team_name = Column(String, unique=False, nullable=False)  # unique per company, not global
+    team_name = Column(String, nullable=False)  # unique per company, not global
     team_password = Column(String, nullable=False)
-    team_files_name = Column(JSON, nullable=True, default=list)
+    team_files_name = relationship("TeamFile", order_by="TeamFile.id", cascade="all, delete-orphan")
 
     company_id = Column(Integer, ForeignKey("company.id"), nullable=False)
     company = relationship("Company", back_populates="teams")
@@ -24,7 +30,7 @@ class Company(Base):
     password = Column(String, nullable=False)
     company_email = Column(String, unique=True, nullable=False)
     session_token = Column(String, index=True, nullable=True)
-    company_files_name = Column(JSON, nullable=True, default=list)
+    company_files_name = relationship("CompanyFile", order_by="CompanyFile.id", cascade="all, delete-orphan")
     no_of_teams = Column(Integer, nullable=False, default=0)
     no_of_projects = Column(Integer, nullable=False, default=0)
 
@@ -33,11 +39,12 @@ class Company(Base):
 
 class Project(Base):
     __tablename__ = "project"
+    __table_args__ = (UniqueConstraint("company_id", "project_name"),)
 
     id = Column(Integer, primary_key=True, index=True)
-    project_name = Column(String, nullable=False, unique=True)
+    project_name = Column(String, nullable=False)  # unique per company, not global
     project_password = Column(String, nullable=False)
-    project_files_name = Column(JSON, nullable=True, default=list)
+    project_files_name = relationship("ProjectFile", order_by="ProjectFile.id", cascade="all, delete-orphan")
     project_description = Column(String, nullable=True)
     no_project_members = Column(Integer, nullable=True)
     project_members = Column(JSON, nullable=True, default=list)
@@ -48,9 +55,150 @@ class Project(Base):
     company = relationship("Company", back_populates="projects")
 
 
+# -------- Uploaded files: one row per PDF, linked to its owner --------
+# Each upload is a single INSERT (and its background ingest a single UPDATE by
+# parent_id) instead of rewriting the owner's whole JSON file list.
+class CompanyFile(Base):
+    __tablename__ = "company_file"
 
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("company.id"), nullable=False, index=True)
+    parent_id = Column(String, nullable=False, index=True)  # id stamped on the file's chunks
+    filename = Column(String, nullable=False)
+    source = Column(String, nullable=False)
+    pdf_name = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="ready")  # processing / ready / failed
+    error = Column(String, nullable=True)  # short reason when status is "failed"
+
+
+class TeamFile(Base):
+    __tablename__ = "team_file"
+
+    id = Column(Integer, primary_key=True, index=True)
+    team_id = Column(Integer, ForeignKey("team.id"), nullable=False, index=True)
+    parent_id = Column(String, nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    source = Column(String, nullable=False)
+    pdf_name = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="ready")
+    error = Column(String, nullable=True)
 
-    
 
+class ProjectFile(Base):
+    __tablename__ = "project_file"
+
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("project.id"), nullable=False, index=True)
+    parent_id = Column(String, nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    source = Column(String, nullable=False)
+    pdf_name = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="ready")
+    error = Column(String, nullable=True)
+
+
+# One-off data move for databases created before the file tables existed:
+# copies every entry of the old `*_files_name` JSON columns into the matching
+# table, then clears the column so running it again copies nothing.
+# create_all() leaves the old columns in place, so no schema change is needed.
+_LEGACY_FILE_LISTS = [
+    ("company", "company_files_name", "company_file", "company_id"),
+    ("team", "team_files_name", "team_file", "team_id"),
+    ("project", "project_files_name", "project_file", "project_id"),
+]
+
+
+def migrate_json_file_lists(engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for owner, column, file_table, fk in _LEGACY_FILE_LISTS:
+            # file tables created before failures recorded a reason
+            if "error" not in {c["name"] for c in inspector.get_columns(file_table)}:
+                conn.execute(text(f"ALTER TABLE {file_table} ADD COLUMN error VARCHAR"))
+            if column not in {c["name"] for c in inspector.get_columns(owner)}:
+                continue
+            conn.execute(text(
+                f"INSERT INTO {file_table} ({fk}, parent_id, filename, source, pdf_name, status) "
+                "SELECT o.id, "
+                "json_extract(f.value, '$.parent_id'), "
+                "coalesce(json_extract(f.value, '$.filename'), ''), "
+                "coalesce(json_extract(f.value, '$.source'), ''), "
+                "coalesce(json_extract(f.value, '$.pdf_name'), ''), "
+                "coalesce(json_extract(f.value, '$.status'), 'ready') "
+                # only real arrays of file entries: a JSON null (or any other
+                # scalar) would come out as one row of empty strings, and an
+                # entry without a parent_id can't be linked back to its chunks
+                f"FROM {owner} o, json_each(CASE WHEN json_valid(o.{column}) "
+                f"AND json_type(o.{column}) = 'array' THEN o.{column} ELSE '[]' END) f "
+                "WHERE f.type = 'object' "
+                "AND coalesce(json_extract(f.value, '$.parent_id'), '') != ''"
+            ))
+            conn.execute(text(f"UPDATE {owner} SET {column} = NULL WHERE {column} IS NOT NULL"))
+
+
+
+
+    
 
 
+# Startup migration for databases created before team/project names became
+# unique per company (create_all() never alters existing tables):
+# - `project` carried a global UNIQUE(project_name) inside its table definition,
+#   which SQLite can only drop by rebuilding the table;
+# - both tables need the (company_id, name) unique index that the
+#   INSERT .. ON CONFLICT in the register endpoints targets.
+# Run after migrate_json_file_lists(), since the rebuild drops legacy columns.
+_NAME_CONSTRAINTS = [
+    ("team", ("company_id", "team_name")),
+    ("project", ("company_id", "project_name")),
+]
+
+
+def _indexes(conn, table):
+    """(name, unique, origin, columns) for every index on `table`."""
+    indexes = []
+    for row in conn.execute(text(f'PRAGMA index_list("{table}")')).mappings():
+        columns = tuple(
+            info["name"] for info in conn.execute(text(f'PRAGMA index_info("{row["name"]}")')).mappings()
+        )
+        indexes.append((row["name"], bool(row["unique"]), row["origin"], columns))
+    return indexes
+
+
+def _rebuild_project_table(conn):
+    old_columns = [c["name"] for c in inspect(conn).get_columns("project")]
+    # keep foreign keys in other tables (project_file) pointing at "project"
+    conn.execute(text("PRAGMA legacy_alter_table = ON"))
+    conn.execute(text("ALTER TABLE project RENAME TO project_old"))
+    for name, _, origin, _ in _indexes(conn, "project_old"):
+        if origin == "c":  # explicit CREATE INDEX; names are global, so free them up
+            conn.execute(text(f'DROP INDEX "{name}"'))
+
+    Project.__table__.create(conn)
+    columns = ", ".join(c for c in old_columns if c in Project.__table__.c)
+    conn.execute(text(f"INSERT INTO project ({columns}) SELECT {columns} FROM project_old"))
+    conn.execute(text("DROP TABLE project_old"))
+    conn.execute(text("PRAGMA legacy_alter_table = OFF"))
+
+
+def migrate_name_constraints(engine):
+    with engine.begin() as conn:
+        if any(unique and columns == ("project_name",) for _, unique, _, columns in _indexes(conn, "project")):
+            _rebuild_project_table(conn)
+
+    for table, columns in _NAME_CONSTRAINTS:
+        with engine.connect() as conn:
+            if any(unique and cols == columns for _, unique, _, cols in _indexes(conn, table)):
+                continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f'CREATE UNIQUE INDEX IF NOT EXISTS "uq_{table}_{"_".join(columns)}" '
+                    f'ON "{table}" ({", ".join(columns)})'
+                ))
+        except IntegrityError:
+            logger.error(
+                "Cannot add UNIQUE(%s) to %s: duplicate names already exist within a company; "
+                "registering under those names will keep failing until they are renamed",
+                ", ".join(columns), table
+            )
@@ -25,6 +25,11 @@ class FileInfo(BaseModel):
     source: str
     filename: str
     parent_id: str
+    status: str = "ready"   # "processing" while embedding runs in the background, then "ready" / "failed"
+    error: Optional[str] = None   # short reason when status is "failed"
+
+    class Config:
+        orm_mode = True
 
 
 # -------- Response Schemas --------
@@ -58,7 +63,7 @@ class TeamCreate(BaseModel):
 class TeamOut(BaseModel):
     id: int
     team_name: str
-    team_files_name: Optional[List[dict]] = []
+    team_files_name: Optional[List[FileInfo]] = Field(default_factory=list)
 
     class Config:
         orm_mode = True
@@ -73,7 +78,7 @@ class ProjectCreate(BaseModel):
 class ProjectOut(BaseModel):
     id: int
     project_name: str
-    project_files_name: Optional[List[dict]] = []
+    project_files_name: Optional[List[FileInfo]] = Field(default_factory=list)
 
     class Config:
         orm_mode = True